@@ -1,19 +1,56 @@
 """FastAPI backend for the Star Wars Data Explorer vertical slice."""
 import asyncio
-import json
+import math
 import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import AsyncIterator, Dict, Iterator, List, Literal, NamedTuple, Optional, Set, Tuple
 
 import httpx
-from fastapi import FastAPI, HTTPException, Query
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
 
 SWAPI_PEOPLE_URL = "https://swapi.dev/api/people/"
+MAX_PEOPLE_PAGES = 11
+MAX_CONCURRENT_NAME_FETCHES = 16
+MAX_NAME_FETCH_RETRIES = 3
+MAX_RETRY_DELAY = 0.5 * 2**MAX_NAME_FETCH_RETRIES  # seconds
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+_INCHES_PER_CM = 1 / 2.54
+MEMORY_CACHE_TTL = 300  # seconds
+# Bump when enrichment changes: caches stored under another version are re-enriched
+# in full on their next read.
+ENRICHMENT_VERSION = "2"
 DB_PATH = Path(__file__).resolve().parent / "swapi_cache.db"
 
-app = FastAPI(title="Star Wars Data Explorer", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Open the SQLite cache and shared SWAPI client before the first request."""
+    await asyncio.to_thread(_init_db)
+    enrichment_version = await asyncio.to_thread(_load_enrichment_version_sync)
+    app.state.enrichment_ok = enrichment_version == ENRICHMENT_VERSION
+    app.state.http = _build_http_client()
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+        app.state.http = None
+        _close_db()
+
+
+app = FastAPI(
+    title="Star Wars Data Explorer",
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # Allow local dev from the React app
 app.add_middleware(
@@ -59,7 +96,13 @@ class ResolveResponse(BaseModel):
     starships: List[str]
 
 
-def _to_float(value: str) -> Optional[float]:
+# Built once so responses serialize straight to JSON bytes without jsonable_encoder.
+CHARACTERS_ADAPTER = TypeAdapter(List[Character])
+RESOLVE_ADAPTER = TypeAdapter(ResolveResponse)
+
+
+@lru_cache(maxsize=512)
+def _to_float(value: Optional[str]) -> Optional[float]:
     """Parse numeric strings while ignoring unknowns and commas."""
     if value is None:
         return None
@@ -75,7 +118,7 @@ def _to_float(value: str) -> Optional[float]:
 def _cm_to_inches(height_cm: Optional[float]) -> Optional[float]:
     if height_cm is None:
         return None
-    return round(height_cm / 2.54, 1)
+    return round(height_cm * _INCHES_PER_CM, 1)
 
 
 def _transform_character(raw: dict) -> dict:
@@ -99,18 +142,136 @@ def _transform_character(raw: dict) -> dict:
     }
 
 
-def _init_db():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS characters (
-                name TEXT PRIMARY KEY,
-                payload TEXT NOT NULL,
-                updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-            )
-            """
+class CharacterSnapshot(NamedTuple):
+    """Characters together with the cache version they were read at."""
+
+    version: int
+    characters: List[dict]
+
+
+# (expires_at, snapshot) so warm requests skip SQLite entirely.
+_mem_cache: Optional[Tuple[float, CharacterSnapshot]] = None
+_source_lock = asyncio.Lock()
+# Serialized /api/characters bodies keyed by (sort_by, order, data version);
+# the version is bumped whenever the character cache is rewritten.
+_response_cache: Dict[Tuple[str, str, int], bytes] = {}
+_data_version = 0
+_db_conn: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """Return the shared SQLite connection, opening it on first use.
+
+    Callers must hold ``_db_lock``. WAL with ``synchronous=NORMAL`` avoids an
+    fsync per commit, which dominates write latency for the cache.
+    """
+    global _db_conn
+    if _db_conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=67108864")
+        _db_conn = conn
+    return _db_conn
+
+
+@contextmanager
+def _transaction() -> Iterator[sqlite3.Connection]:
+    """Run the enclosed statements as one BEGIN/COMMIT on the shared connection."""
+    with _db_lock:
+        conn = _connect()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def _close_db() -> None:
+    global _db_conn
+    with _db_lock:
+        if _db_conn is not None:
+            _db_conn.close()
+            _db_conn = None
+
+
+CHARACTER_SCALAR_COLUMNS = (
+    "name",
+    "height_cm",
+    "height_in",
+    "mass_kg",
+    "birth_year",
+    "gender",
+    "hair_color",
+    "eye_color",
+    "homeworld",
+    "homeworld_name",
+    "url",
+)
+# List fields are small, so they stay as JSON text rather than side tables.
+CHARACTER_LIST_COLUMNS = (
+    "films",
+    "film_titles",
+    "species",
+    "species_names",
+    "starships",
+    "starship_names",
+)
+CHARACTER_COLUMNS = CHARACTER_SCALAR_COLUMNS + CHARACTER_LIST_COLUMNS
+INSERT_CHARACTER_SQL = "INSERT INTO characters (%s) VALUES (%s)" % (
+    ", ".join(CHARACTER_COLUMNS),
+    ", ".join(["?"] * len(CHARACTER_COLUMNS)),
+)
+SELECT_CHARACTERS_SQL = "SELECT %s FROM characters" % ", ".join(CHARACTER_COLUMNS)
+
+
+def _create_characters_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS characters (
+            name TEXT PRIMARY KEY,
+            height_cm REAL,
+            height_in REAL,
+            mass_kg REAL,
+            birth_year TEXT,
+            gender TEXT,
+            hair_color TEXT,
+            eye_color TEXT,
+            homeworld TEXT,
+            homeworld_name TEXT,
+            url TEXT,
+            films TEXT NOT NULL DEFAULT '[]',
+            film_titles TEXT NOT NULL DEFAULT '[]',
+            species TEXT NOT NULL DEFAULT '[]',
+            species_names TEXT NOT NULL DEFAULT '[]',
+            starships TEXT NOT NULL DEFAULT '[]',
+            starship_names TEXT NOT NULL DEFAULT '[]',
+            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
         )
+        """
+    )
+
+
+def _migrate_payload_cache(conn: sqlite3.Connection) -> None:
+    """Convert a pre-column cache (one JSON payload per row) to typed columns."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(characters)")}
+    if "payload" not in columns:
+        return
+    legacy = [orjson.loads(row[0]) for row in conn.execute("SELECT payload FROM characters")]
+    conn.execute("DROP TABLE characters")
+    _create_characters_table(conn)
+    conn.executemany(INSERT_CHARACTER_SQL, [_character_row(char) for char in legacy])
+
+
+def _init_db():
+    with _transaction() as conn:
+        _create_characters_table(conn)
+        _migrate_payload_cache(conn)
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS resolved_names (
@@ -120,25 +281,49 @@ def _init_db():
             )
             """
         )
-        conn.commit()
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
 
 
-def _load_cached_characters() -> List[dict]:
-    if not DB_PATH.exists():
-        return []
-    with sqlite3.connect(DB_PATH) as conn:
-        rows = conn.execute("SELECT payload FROM characters").fetchall()
-    return [_ensure_display_fields(json.loads(row[0])) for row in rows]
+def _load_enrichment_version_sync() -> Optional[str]:
+    with _db_lock:
+        row = _connect().execute(
+            "SELECT value FROM meta WHERE key = 'enrichment_version'"
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _character_row(char: dict) -> tuple:
+    _ensure_display_fields(char)
+    return tuple(char.get(column) for column in CHARACTER_SCALAR_COLUMNS) + tuple(
+        orjson.dumps(char.get(column) or []).decode() for column in CHARACTER_LIST_COLUMNS
+    )
 
 
-def _replace_cache(characters: List[dict]) -> None:
-    with sqlite3.connect(DB_PATH) as conn:
+def _load_cached_characters_sync() -> List[dict]:
+    if not DB_PATH.exists():
+        return []
+    with _db_lock:
+        cursor = _connect().cursor()
+        cursor.row_factory = sqlite3.Row
+        rows = cursor.execute(SELECT_CHARACTERS_SQL).fetchall()
+    characters = []
+    for row in rows:
+        char = dict(row)
+        for column in CHARACTER_LIST_COLUMNS:
+            char[column] = orjson.loads(char[column])
+        characters.append(char)
+    return characters
+
+
+def _replace_cache_sync(characters: List[dict]) -> None:
+    rows = [_character_row(char) for char in characters]
+    with _transaction() as conn:
         conn.execute("DELETE FROM characters")
-        conn.executemany(
-            "INSERT INTO characters (name, payload) VALUES (?, ?)",
-            [(char["name"], json.dumps(_ensure_display_fields(char))) for char in characters],
+        conn.executemany(INSERT_CHARACTER_SQL, rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('enrichment_version', ?)",
+            (ENRICHMENT_VERSION,),
         )
-        conn.commit()
 
 
 def _ensure_display_fields(char: dict) -> dict:
@@ -150,64 +335,151 @@ def _ensure_display_fields(char: dict) -> dict:
     return char
 
 
-def _load_cached_names(urls: Set[str]) -> Dict[str, str]:
+def _load_cached_names_sync(urls: Set[str]) -> Dict[str, str]:
     if not urls:
         return {}
-    with sqlite3.connect(DB_PATH) as conn:
+    # Join against a temp table so the statements stay fixed (and stay in
+    # sqlite's statement cache) whatever the number of URLs.
+    with _transaction() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_urls (url TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM lookup_urls")
+        conn.executemany("INSERT INTO lookup_urls (url) VALUES (?)", [(url,) for url in urls])
         rows = conn.execute(
-            "SELECT url, name FROM resolved_names WHERE url IN (%s)"
-            % ",".join(["?"] * len(urls)),
-            list(urls),
+            "SELECT url, name FROM resolved_names JOIN lookup_urls USING (url)"
         ).fetchall()
     return {url: name for url, name in rows}
 
 
-def _store_names(pairs: Dict[str, str]) -> None:
+def _store_names_sync(pairs: Dict[str, str]) -> None:
     if not pairs:
         return
-    with sqlite3.connect(DB_PATH) as conn:
+    with _transaction() as conn:
         conn.executemany(
             "INSERT OR REPLACE INTO resolved_names (url, name) VALUES (?, ?)",
             [(url, name) for url, name in pairs.items()],
         )
-        conn.commit()
 
 
-def _sorting_key(field: str):
-    def key(item: dict):
-        value = item.get(field)
-        is_missing = value is None
-        comparable = value
-        if isinstance(value, str):
-            comparable = value.lower()
-        return (is_missing, comparable)
+# SQLite calls block on file I/O, so async callers run them in a worker thread.
+async def _load_cached_characters() -> List[dict]:
+    return await asyncio.to_thread(_load_cached_characters_sync)
+
+
+async def _replace_cache(characters: List[dict]) -> None:
+    """Persist enriched characters; the stored rows then need no enrichment scan."""
+    global _data_version
+    await asyncio.to_thread(_replace_cache_sync, characters)
+    app.state.enrichment_ok = True
+    _data_version += 1
+    _response_cache.clear()
+
+
+async def _load_cached_names(urls: Set[str]) -> Dict[str, str]:
+    return await asyncio.to_thread(_load_cached_names_sync, urls)
+
+
+async def _store_names(pairs: Dict[str, str]) -> None:
+    await asyncio.to_thread(_store_names_sync, pairs)
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=10,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    )
+
+
+def _http_client() -> httpx.AsyncClient:
+    """Return the shared SWAPI client, creating it if the lifespan has not run."""
+    client = getattr(app.state, "http", None)
+    if client is None:
+        client = app.state.http = _build_http_client()
+    return client
 
-    return key
+
+def _raw_column(field: str):
+    def column(characters: List[dict]) -> list:
+        return [char.get(field) for char in characters]
+
+    return column
+
+
+def _lowered_column(field: str):
+    def column(characters: List[dict]) -> list:
+        return [
+            value.lower() if value is not None else None
+            for value in (char.get(field) for char in characters)
+        ]
+
+    return column
+
+
+# Column extractors built once per sortable field, so string fields are
+# lowercased without a per-request type check.
+SORT_COLUMNS = {
+    "name": _lowered_column("name"),
+    "height_cm": _raw_column("height_cm"),
+    "mass_kg": _raw_column("mass_kg"),
+    "birth_year": _lowered_column("birth_year"),
+    "gender": _lowered_column("gender"),
+    "homeworld": _lowered_column("homeworld"),
+}
+
+
+def _sort_characters(characters: List[dict], field: str, reverse: bool) -> List[dict]:
+    """Sort by a field with missing values grouped together.
+
+    The field is pulled into a flat column once and the row indices of present
+    values are sorted against it, so comparisons are plain floats/strings
+    rather than per-row key tuples. Missing values go last ascending and first
+    descending.
+    """
+    extract = SORT_COLUMNS.get(field) or _raw_column(field)
+    column = extract(characters)
+    present = [index for index, value in enumerate(column) if value is not None]
+    missing = [characters[index] for index, value in enumerate(column) if value is None]
+    present.sort(key=column.__getitem__, reverse=reverse)
+    ordered = [characters[index] for index in present]
+    return missing + ordered if reverse else ordered + missing
+
+
+async def _fetch_people_page(client: httpx.AsyncClient, url: str) -> dict:
+    """Fetch one people page, reducing each person to the fields we keep."""
+    response = await client.get(url)
+    response.raise_for_status()
+    try:
+        payload = orjson.loads(response.content)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=502,
+            detail="Received invalid data from SWAPI.",
+        ) from exc
+    # Drop the raw SWAPI dicts as soon as a page lands rather than holding every page.
+    payload["results"] = [_transform_character(person) for person in payload.get("results", [])]
+    return payload
 
 
 async def _fetch_people() -> List[dict]:
-    """Fetch all people pages from SWAPI."""
+    """Fetch all people pages from SWAPI as simplified characters.
+
+    The first page reports the total count, so the remaining page URLs are
+    known up front and fetched concurrently.
+    """
     results: List[dict] = []
-    next_url: Optional[str] = SWAPI_PEOPLE_URL
-    page_counter = 0
 
+    client = _http_client()
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            while next_url:
-                response = await client.get(next_url)
-                response.raise_for_status()
-                try:
-                    payload = response.json()
-                except ValueError as exc:
-                    raise HTTPException(
-                        status_code=502,
-                        detail="Received invalid data from SWAPI.",
-                    ) from exc
-                results.extend(payload.get("results", []))
-                next_url = payload.get("next")
-                page_counter += 1
-                if page_counter > 10:  # guard against runaway pagination
-                    break
+        payload = await _fetch_people_page(client, SWAPI_PEOPLE_URL)
+        first_results = payload.get("results", [])
+        results.extend(first_results)
+        if payload.get("next") and first_results:
+            total_pages = math.ceil(payload.get("count", 0) / len(first_results))
+            total_pages = min(total_pages, MAX_PEOPLE_PAGES)  # guard against runaway pagination
+            urls = [f"{SWAPI_PEOPLE_URL}?page={page}" for page in range(2, total_pages + 1)]
+            pages = await asyncio.gather(*[_fetch_people_page(client, url) for url in urls])
+            for page in pages:
+                results.extend(page.get("results", []))
     except httpx.HTTPStatusError as exc:
         raise HTTPException(
             status_code=502,
@@ -224,20 +496,49 @@ async def _fetch_people() -> List[dict]:
     return results
 
 
-async def _get_characters_from_source(refresh: bool) -> List[dict]:
+def _fresh_snapshot() -> Optional[CharacterSnapshot]:
+    if _mem_cache is not None and _mem_cache[0] > time.monotonic():
+        return _mem_cache[1]
+    return None
+
+
+async def _get_characters_from_source(refresh: bool) -> CharacterSnapshot:
+    """Return characters, serving repeat requests from an in-process snapshot.
+
+    Misses and refreshes run one at a time so a slow cold read can never
+    install older rows over a refresh that finished first. Every cache write
+    happens under the same lock, so the version recorded here is the one the
+    characters were actually read at.
+    """
+    global _mem_cache
+    if not refresh and (snapshot := _fresh_snapshot()) is not None:
+        return snapshot
+
+    async with _source_lock:
+        # Another request may have rebuilt the snapshot while this one waited.
+        if not refresh and (snapshot := _fresh_snapshot()) is not None:
+            return snapshot
+        _mem_cache = None
+        characters = await _load_characters(refresh)
+        snapshot = CharacterSnapshot(_data_version, characters)
+        _mem_cache = (time.monotonic() + MEMORY_CACHE_TTL, snapshot)
+        return snapshot
+
+
+async def _load_characters(refresh: bool) -> List[dict]:
     """Return characters, using cache unless refresh is requested or cache empty."""
-    cached = [] if refresh else _load_cached_characters()
+    cached = [] if refresh else await _load_cached_characters()
     if cached:
-        if _needs_name_enrichment(cached):
-            enriched_cached = await _enrich_with_names(cached)
-            _replace_cache(enriched_cached)
-            return enriched_cached
-        return cached
-
-    raw_people = await _fetch_people()
-    simplified = [_transform_character(person) for person in raw_people]
+        if getattr(app.state, "enrichment_ok", False):
+            return cached
+        # Stored under another ENRICHMENT_VERSION (or none): rebuild every name field.
+        enriched_cached = await _enrich_with_names(cached)
+        await _replace_cache(enriched_cached)
+        return enriched_cached
+
+    simplified = await _fetch_people()
     enriched = await _enrich_with_names(simplified)
-    _replace_cache(enriched)
+    await _replace_cache(enriched)
     return enriched
 
 
@@ -251,36 +552,60 @@ async def _enrich_with_names(characters: List[dict]) -> List[dict]:
 
     resolved = await _resolve_urls(url_set)
 
+    resolved_get = resolved.get
     for char in characters:
-        char["homeworld_name"] = resolved.get(char.get("homeworld"))
-        char["film_titles"] = [resolved.get(url) for url in char.get("films", []) if resolved.get(url)]
-        char["species_names"] = [resolved.get(url) for url in char.get("species", []) if resolved.get(url)]
-        char["starship_names"] = [resolved.get(url) for url in char.get("starships", []) if resolved.get(url)]
+        char["homeworld_name"] = resolved_get(char.get("homeworld"))
+        char["film_titles"] = [name for url in char.get("films", []) if (name := resolved_get(url))]
+        char["species_names"] = [name for url in char.get("species", []) if (name := resolved_get(url))]
+        char["starship_names"] = [
+            name for url in char.get("starships", []) if (name := resolved_get(url))
+        ]
 
     return [_ensure_display_fields(char) for char in characters]
 
 
-def _needs_name_enrichment(characters: List[dict]) -> bool:
-    """Detect if any character is missing resolved display names."""
-    for char in characters:
-        if char.get("homeworld") and not char.get("homeworld_name"):
-            return True
-        if char.get("films") and not char.get("film_titles"):
-            return True
-        if char.get("species") and not char.get("species_names"):
-            return True
-        if char.get("starships") and not char.get("starship_names"):
-            return True
-    return False
+# Caps concurrent name lookups so a large fan-out does not trip SWAPI rate limits.
+_name_fetch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_NAME_FETCHES)
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    """Honor Retry-After when SWAPI sends it, otherwise back off exponentially.
+
+    Retry-After is capped at the longest backoff step so a large server value
+    cannot hold the user's request open for minutes.
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), MAX_RETRY_DELAY)
+        except ValueError:
+            pass
+    return 0.5 * 2**attempt
+
+
+async def _get_with_retry(client: httpx.AsyncClient, url: str) -> httpx.Response:
+    """GET a URL under the concurrency cap, retrying throttled or transient errors."""
+    attempt = 0
+    while True:
+        async with _name_fetch_semaphore:
+            response = await client.get(url)
+        try:
+            response.raise_for_status()
+            return response
+        except httpx.HTTPStatusError as exc:
+            status = exc.response.status_code
+            if status not in RETRYABLE_STATUS_CODES or attempt >= MAX_NAME_FETCH_RETRIES:
+                raise
+        await asyncio.sleep(_retry_delay(response, attempt))
+        attempt += 1
 
 
 async def _fetch_name(client: httpx.AsyncClient, url: str) -> Optional[str]:
     """Fetch a resource by URL and return its name/title field."""
     try:
-        response = await client.get(url)
-        response.raise_for_status()
+        response = await _get_with_retry(client, url)
         try:
-            payload = response.json()
+            payload = orjson.loads(response.content)
         except ValueError as exc:
             raise HTTPException(
                 status_code=502, detail="Received invalid data from SWAPI."
@@ -302,49 +627,73 @@ async def _fetch_name(client: httpx.AsyncClient, url: str) -> Optional[str]:
         raise HTTPException(status_code=502, detail="Failed to resolve SWAPI data.") from exc
 
 
+# In-flight name lookups keyed by URL, so concurrent requests share one SWAPI call.
+_inflight: Dict[str, "asyncio.Task[Optional[str]]"] = {}
+
+
+async def _fetch_name_shared(client: httpx.AsyncClient, url: str) -> Optional[str]:
+    """Join an in-flight lookup for the URL, or start one others can join."""
+    task = _inflight.get(url)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_name(client, url))
+        _inflight[url] = task
+
+        def _forget(done: asyncio.Task) -> None:
+            if _inflight.get(url) is done:
+                del _inflight[url]
+
+        task.add_done_callback(_forget)
+    # Shield so one caller being cancelled does not cancel the lookup for the rest.
+    return await asyncio.shield(task)
+
+
 async def _resolve_urls(urls: Set[str]) -> Dict[str, str]:
     """Resolve a set of URLs to names using cache first, then SWAPI."""
     urls = {u for u in urls if u}
     if not urls:
         return {}
 
-    cached = _load_cached_names(urls)
+    cached = await _load_cached_names(urls)
     missing = [u for u in urls if u not in cached]
     fresh: Dict[str, Optional[str]] = {}
 
     if missing:
-        async with httpx.AsyncClient(timeout=10) as client:
-            results = await asyncio.gather(*[_fetch_name(client, url) for url in missing])
+        client = _http_client()
+        results = await asyncio.gather(*[_fetch_name_shared(client, url) for url in missing])
         fresh = {url: name for url, name in zip(missing, results) if name}
         if fresh:
-            _store_names(fresh)
+            await _store_names(fresh)
 
     combined = {**cached, **fresh}
     return combined
 
 
+async def get_characters_source(
+    refresh: bool = Query(False, description="Force refresh from SWAPI and repopulate cache"),
+) -> CharacterSnapshot:
+    """Dependency supplying characters to the route; tests swap it via dependency_overrides."""
+    return await _get_characters_from_source(refresh)
+
+
 @app.get("/api/characters", response_model=List[Character])
 async def list_characters(
-    sort_by: str = Query(
-        "mass_kg",
-        enum=["name", "height_cm", "mass_kg", "birth_year"],
-        description="Server-side sort field",
+    sort_by: Literal["name", "height_cm", "mass_kg", "birth_year"] = Query(
+        "mass_kg", description="Server-side sort field"
     ),
-    order: str = Query("desc", enum=["asc", "desc"], description="Sort order"),
-    refresh: bool = Query(False, description="Force refresh from SWAPI and repopulate cache"),
+    order: Literal["asc", "desc"] = Query("desc", description="Sort order"),
+    snapshot: CharacterSnapshot = Depends(get_characters_source),
 ):
     """Fetch characters from SWAPI, simplify the shape, and sort before returning."""
 
-    simplified = await _get_characters_from_source(refresh)
-
-    reverse = order == "desc"
-    simplified.sort(key=_sorting_key(sort_by), reverse=reverse)
-    return simplified
-
-
-@app.on_event("startup")
-def startup_event():
-    _init_db()
+    # Key on the snapshot's own version so a body is never filed under newer data.
+    cache_key = (sort_by, order, snapshot.version)
+    body = _response_cache.get(cache_key)
+    if body is None:
+        reverse = order == "desc"
+        simplified = _sort_characters(snapshot.characters, sort_by, reverse)
+        characters = CHARACTERS_ADAPTER.validate_python(simplified)
+        body = _response_cache[cache_key] = CHARACTERS_ADAPTER.dump_json(characters)
+    return Response(body, media_type="application/json")
 
 
 @app.post("/api/resolve", response_model=ResolveResponse)
@@ -360,16 +709,17 @@ async def resolve_entities(payload: ResolveRequest):
     resolved = await _resolve_urls(urls)
 
     homeworld_name = resolved.get(payload.homeworld) if payload.homeworld else None
-    films = [resolved.get(url) for url in payload.films if resolved.get(url)]
-    species = [resolved.get(url) for url in payload.species if resolved.get(url)]
-    starships = [resolved.get(url) for url in payload.starships if resolved.get(url)]
+    films = [name for url in payload.films if (name := resolved.get(url))]
+    species = [name for url in payload.species if (name := resolved.get(url))]
+    starships = [name for url in payload.starships if (name := resolved.get(url))]
 
-    return ResolveResponse(
+    resolved_response = ResolveResponse(
         homeworld=homeworld_name,
         films=films,
         species=species,
         starships=starships,
     )
+    return Response(RESOLVE_ADAPTER.dump_json(resolved_response), media_type="application/json")
 
 
 @app.get("/health")
@@ -380,5 +730,6 @@ async def health() -> dict:
 if __name__ == "__main__":
     import uvicorn
 
-    _init_db()
+    # uvicorn's "auto" loop/http pick uvloop and httptools from uvicorn[standard]
+    # where they are installed (not on Windows) and fall back to asyncio/h11.
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
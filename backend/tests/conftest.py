@@ -1,6 +1,131 @@
+"""Shared fixtures for the API tests.
+
+Tests are safe to run in parallel with ``pytest -n auto``: each test gets its own
+SQLite file and fresh in-memory caches (``isolated_db``), and fakes are installed
+through fixtures (``sample_source``, ``mock_swapi``) that undo themselves. New tests
+should swap app state through these fixtures rather than assigning module globals.
+"""
+import asyncio
+
+import httpx
 import pytest
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+from pytest_asyncio import is_async_test
+
+import app.main as main
+
+try:
+    import uvloop
+except ImportError:  # uvicorn[standard] skips uvloop on Windows
+    uvloop = None
+
+# Built once per process; the characters route sorts into a new list and does
+# not mutate these dicts, so tests can share them without copying.
+SAMPLE_CHARACTERS = [
+    {
+        "name": "Heavy",
+        "height_cm": 180,
+        "height_in": 70.9,
+        "mass_kg": 120,
+        "birth_year": "10BBY",
+        "gender": "male",
+        "hair_color": "brown",
+        "eye_color": "brown",
+        "homeworld": "http://swapi.test/planets/1",
+        "homeworld_name": "World A",
+        "films": ["http://swapi.test/films/1"],
+        "film_titles": ["Film One"],
+        "species": ["http://swapi.test/species/1"],
+        "species_names": ["Spec One"],
+        "starships": ["http://swapi.test/starships/1"],
+        "starship_names": ["Ship One"],
+        "url": "http://swapi.test/people/1",
+    },
+    {
+        "name": "Light",
+        "height_cm": 150,
+        "height_in": 59.1,
+        "mass_kg": 60,
+        "birth_year": "12BBY",
+        "gender": "female",
+        "hair_color": "black",
+        "eye_color": "green",
+        "homeworld": "http://swapi.test/planets/2",
+        "homeworld_name": "World B",
+        "films": ["http://swapi.test/films/2"],
+        "film_titles": ["Film Two"],
+        "species": ["http://swapi.test/species/2"],
+        "species_names": ["Spec Two"],
+        "starships": [],
+        "starship_names": [],
+        "url": "http://swapi.test/people/2",
+    },
+]
+
+
+def pytest_collection_modifyitems(items):
+    """Run every async test on the session loop the shared client lives on."""
+    session_loop = pytest.mark.asyncio(loop_scope="session")
+    for item in items:
+        if is_async_test(item):
+            item.add_marker(session_loop, append=False)
+
+
+@pytest.fixture(scope="session")
+def event_loop_policy():
+    """Run the session loop on uvloop, matching how the app is served."""
+    if uvloop is None:
+        return asyncio.DefaultEventLoopPolicy()
+    return uvloop.EventLoopPolicy()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def client():
+    """One ASGI client shared by every test in the session.
+
+    ASGITransport never sends lifespan events, so the app's lifespan (SQLite init
+    against the real cache file, a live HTTP/2 SWAPI client) does not run here;
+    ``isolated_db`` and ``mock_swapi`` stand in for it per test.
+    """
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as ac:
+        yield ac
+
+
+@pytest.fixture(scope="module")
+def sample_characters():
+    return SAMPLE_CHARACTERS
+
+
+@pytest.fixture
+def sample_source(sample_characters):
+    """Serve SAMPLE_CHARACTERS from /api/characters without touching SWAPI or SQLite."""
+    snapshot = main.CharacterSnapshot(version=0, characters=sample_characters)
+    main.app.dependency_overrides[main.get_characters_source] = lambda: snapshot
+    yield sample_characters
+    main.app.dependency_overrides.pop(main.get_characters_source, None)
 
 
 @pytest.fixture
-def anyio_backend():
-    return "asyncio"
+def mock_swapi(monkeypatch):
+    """Install a SWAPI client whose responses come from an httpx.MockTransport handler."""
+
+    def install(handler):
+        swapi = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(main.app.state, "http", swapi, raising=False)
+        return swapi
+
+    return install
+
+
+@pytest.fixture(autouse=True)
+def isolated_db(tmp_path, monkeypatch):
+    """Point the shared SQLite connection at a throwaway file for each test."""
+    main._close_db()
+    monkeypatch.setattr(main, "_mem_cache", None)
+    monkeypatch.setattr(main, "_response_cache", {})
+    monkeypatch.setattr(main.app.state, "enrichment_ok", False, raising=False)
+    monkeypatch.setattr(main, "DB_PATH", tmp_path / "swapi_cache.db")
+    main._init_db()
+    yield
+    main._close_db()
@@ -1,138 +1,257 @@
+import asyncio
+
 import httpx
+import orjson
 import pytest
-from httpx import AsyncClient, ASGITransport
-
-from app.main import app
 
+import app.main as main
+from app.main import SWAPI_PEOPLE_URL, _fetch_name, _fetch_people, health
 
-transport = ASGITransport(app=app)
+EXPECTED_HEALTH = b'{"status":"ok"}'
 
 
-@pytest.mark.anyio("asyncio")
 async def test_health_endpoint():
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        resp = await ac.get("/health")
+    assert await health() == {"status": "ok"}
+
+
+async def test_health_response_is_orjson_encoded(client):
+    resp = await client.get("/health")
+
     assert resp.status_code == 200
-    assert resp.json() == {"status": "ok"}
-
-
-@pytest.mark.anyio("asyncio")
-async def test_characters_sorted_and_enriched(monkeypatch):
-    sample = [
-        {
-            "name": "Heavy",
-            "height_cm": 180,
-            "height_in": 70.9,
-            "mass_kg": 120,
-            "birth_year": "10BBY",
-            "gender": "male",
-            "hair_color": "brown",
-            "eye_color": "brown",
-            "homeworld": "http://swapi.test/planets/1",
-            "homeworld_name": "World A",
-            "films": ["http://swapi.test/films/1"],
-            "film_titles": ["Film One"],
-            "species": ["http://swapi.test/species/1"],
-            "species_names": ["Spec One"],
-            "starships": ["http://swapi.test/starships/1"],
-            "starship_names": ["Ship One"],
-            "url": "http://swapi.test/people/1",
-        },
-        {
-            "name": "Light",
-            "height_cm": 150,
-            "height_in": 59.1,
-            "mass_kg": 60,
-            "birth_year": "12BBY",
-            "gender": "female",
-            "hair_color": "black",
-            "eye_color": "green",
-            "homeworld": "http://swapi.test/planets/2",
-            "homeworld_name": "World B",
-            "films": ["http://swapi.test/films/2"],
-            "film_titles": ["Film Two"],
-            "species": ["http://swapi.test/species/2"],
-            "species_names": ["Spec Two"],
-            "starships": [],
-            "starship_names": [],
-            "url": "http://swapi.test/people/2",
-        },
-    ]
-
-    async def fake_source(refresh: bool):
-        return sample
-
-    monkeypatch.setattr("app.main._get_characters_from_source", fake_source)
-
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        resp = await ac.get("/api/characters?sort_by=mass_kg&order=desc")
+    assert resp.headers["content-type"] == "application/json"
+    assert resp.content == EXPECTED_HEALTH
+
+
+@pytest.mark.parametrize(
+    "sort_by,order,expected_names",
+    [
+        ("mass_kg", "desc", ["Heavy", "Light"]),
+        ("mass_kg", "asc", ["Light", "Heavy"]),
+        ("height_cm", "asc", ["Light", "Heavy"]),
+        ("name", "asc", ["Heavy", "Light"]),
+        ("name", "desc", ["Light", "Heavy"]),
+    ],
+)
+async def test_characters_sorted_and_enriched(client, sample_source, sort_by, order, expected_names):
+    resp = await client.get("/api/characters", params={"sort_by": sort_by, "order": order})
 
     assert resp.status_code == 200
-    data = resp.json()
-    assert [c["name"] for c in data] == ["Heavy", "Light"]
-    assert data[0]["homeworld_name"] == "World A"
-    assert data[0]["film_titles"] == ["Film One"]
-    assert data[1]["species_names"] == ["Spec Two"]
+    data = orjson.loads(resp.content)
+    assert [c["name"] for c in data] == expected_names
+    by_name = {c["name"]: c for c in data}
+    assert by_name["Heavy"]["homeworld_name"] == "World A"
+    assert by_name["Heavy"]["film_titles"] == ["Film One"]
+    assert by_name["Light"]["species_names"] == ["Spec Two"]
+
 
+@pytest.mark.parametrize("params", [{"sort_by": "junk"}, {"order": "sideways"}])
+async def test_characters_rejects_unknown_sort_params(client, sample_source, params):
+    resp = await client.get("/api/characters", params=params)
 
-@pytest.mark.anyio("asyncio")
-async def test_characters_swapi_http_error(monkeypatch):
-    request = httpx.Request("GET", "https://swapi.dev/api/people/")
+    assert resp.status_code == 422
+    assert main._response_cache == {}
 
-    class FakeResponse:
-        def __init__(self):
-            self.response = httpx.Response(500, request=request)
 
-        def raise_for_status(self):
-            raise httpx.HTTPStatusError("boom", request=request, response=self.response)
+async def test_characters_repeat_request_reuses_serialized_body(client, sample_source, monkeypatch):
+    sorts = []
+    sort_characters = main._sort_characters
 
-        def json(self):
-            return {}
+    def counting_sort(characters, field, reverse):
+        sorts.append(field)
+        return sort_characters(characters, field, reverse)
 
-    class FakeClient:
-        def __init__(self, *args, **kwargs):
-            pass
+    monkeypatch.setattr(main, "_sort_characters", counting_sort)
 
-        async def __aenter__(self):
-            return self
+    first = await client.get("/api/characters", params={"sort_by": "name", "order": "asc"})
+    second = await client.get("/api/characters", params={"sort_by": "name", "order": "asc"})
 
-        async def __aexit__(self, exc_type, exc, tb):
-            return False
+    assert first.content == second.content
+    assert sorts == ["name"]
 
-        async def get(self, url):
-            return FakeResponse()
 
-    monkeypatch.setattr("app.main.httpx.AsyncClient", FakeClient)
+async def test_characters_body_is_keyed_by_snapshot_version(client, sample_source, monkeypatch):
+    monkeypatch.setattr(main, "_data_version", 5)
 
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        resp = await ac.get("/api/characters?refresh=true")
+    resp = await client.get("/api/characters", params={"sort_by": "name", "order": "asc"})
+
+    assert resp.status_code == 200
+    assert list(main._response_cache) == [("name", "asc", 0)]
+
+
+async def test_characters_swapi_http_error(client, mock_swapi):
+    mock_swapi(lambda request: httpx.Response(500))
+
+    resp = await client.get("/api/characters?refresh=true")
 
     assert resp.status_code == 502
-    assert "SWAPI returned an error" in resp.json()["detail"]
+    assert "SWAPI returned an error" in orjson.loads(resp.content)["detail"]
+
+
+async def test_resolve_swapi_network_error(client, mock_swapi):
+    def network_down(request):
+        raise httpx.ConnectError("network down", request=request)
 
+    mock_swapi(network_down)
 
-@pytest.mark.anyio("asyncio")
-async def test_resolve_swapi_network_error(monkeypatch):
-    class FailingClient:
-        def __init__(self, *args, **kwargs):
-            pass
+    resp = await client.post(
+        "/api/resolve",
+        json={"homeworld": "https://swapi.dev/api/planets/1"},
+    )
+
+    assert resp.status_code == 504
+    assert "Unable to reach SWAPI" in orjson.loads(resp.content)["detail"]
+
+
+async def test_fetch_people_requests_remaining_pages(mock_swapi):
+    requested = []
+
+    def paged(request):
+        requested.append(str(request.url))
+        page = int(request.url.params.get("page", 1))
+        payload = {
+            "count": 5,
+            "next": f"{SWAPI_PEOPLE_URL}?page={page + 1}" if page < 3 else None,
+            "results": [{"name": f"Person {page}-{i}"} for i in range(2 if page < 3 else 1)],
+        }
+        return httpx.Response(200, json=payload)
+
+    mock_swapi(paged)
+
+    people = await _fetch_people()
+
+    assert sorted(requested) == [SWAPI_PEOPLE_URL, f"{SWAPI_PEOPLE_URL}?page=2", f"{SWAPI_PEOPLE_URL}?page=3"]
+    assert [p["name"] for p in people] == ["Person 1-0", "Person 1-1", "Person 2-0", "Person 2-1", "Person 3-0"]
+    assert set(people[0]) == {
+        "name", "height_cm", "height_in", "mass_kg", "birth_year", "gender", "hair_color",
+        "eye_color", "homeworld", "films", "species", "starships", "url",
+    }
 
-        async def __aenter__(self):
-            return self
 
-        async def __aexit__(self, exc_type, exc, tb):
-            return False
+async def test_fetch_name_retries_throttled_requests(mock_swapi):
+    url = "http://swapi.test/planets/1"
+    calls = []
 
-        async def get(self, url):
-            raise httpx.RequestError("network down", request=httpx.Request("GET", url))
+    def throttled(request):
+        calls.append(request.url)
+        if len(calls) < 3:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={"name": "Tatooine"})
 
-    monkeypatch.setattr("app.main.httpx.AsyncClient", FailingClient)
+    assert await _fetch_name(mock_swapi(throttled), url) == "Tatooine"
+    assert len(calls) == 3
 
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        resp = await ac.post(
-            "/api/resolve",
-            json={"homeworld": "https://swapi.dev/api/planets/1"},
+
+def test_init_db_migrates_payload_cache():
+    with main._transaction() as conn:
+        conn.execute("DROP TABLE characters")
+        conn.execute("CREATE TABLE characters (name TEXT PRIMARY KEY, payload TEXT NOT NULL)")
+        conn.execute(
+            "INSERT INTO characters (name, payload) VALUES (?, ?)",
+            ("Legacy", '{"name": "Legacy", "mass_kg": 80.0, "films": ["http://swapi.test/films/1"]}'),
         )
 
-    assert resp.status_code == 504
-    assert "Unable to reach SWAPI" in resp.json()["detail"]
+    main._init_db()
+
+    [char] = main._load_cached_characters_sync()
+    assert char["name"] == "Legacy"
+    assert char["mass_kg"] == 80.0
+    assert char["films"] == ["http://swapi.test/films/1"]
+    assert char["film_titles"] == []
+
+
+async def test_character_source_reuses_memory_snapshot(monkeypatch):
+    loads = []
+
+    async def fake_load(refresh: bool):
+        loads.append(refresh)
+        return [{"name": "Cached"}]
+
+    monkeypatch.setattr(main, "_load_characters", fake_load)
+
+    first = await main._get_characters_from_source(False)
+    second = await main._get_characters_from_source(False)
+    await main._get_characters_from_source(True)
+
+    assert first is second
+    assert first.characters == [{"name": "Cached"}]
+    assert loads == [False, True]
+
+
+def test_load_cached_names_returns_only_requested_urls():
+    main._store_names_sync({"http://swapi.test/films/1": "Film One", "http://swapi.test/films/2": "Film Two"})
+
+    names = main._load_cached_names_sync({"http://swapi.test/films/1", "http://swapi.test/films/3"})
+
+    assert names == {"http://swapi.test/films/1": "Film One"}
+
+
+async def test_concurrent_name_lookups_share_one_request(mock_swapi):
+    url = "http://swapi.test/planets/1"
+    calls = []
+
+    async def slow(request):
+        calls.append(str(request.url))
+        await asyncio.sleep(0)
+        return httpx.Response(200, json={"name": "Tatooine"})
+
+    client = mock_swapi(slow)
+    names = await asyncio.gather(
+        main._fetch_name_shared(client, url), main._fetch_name_shared(client, url)
+    )
+
+    assert names == ["Tatooine", "Tatooine"]
+    assert calls == [url]
+    assert url not in main._inflight
+
+
+def test_replace_cache_records_enrichment_version():
+    assert main._load_enrichment_version_sync() is None
+
+    main._replace_cache_sync([{"name": "Stored", "films": [], "species": [], "starships": []}])
+
+    assert main._load_enrichment_version_sync() == main.ENRICHMENT_VERSION
+
+
+def test_retry_delay_caps_retry_after():
+    response = httpx.Response(429, headers={"Retry-After": "3600"})
+
+    assert main._retry_delay(response, 0) == main.MAX_RETRY_DELAY
+
+
+async def test_slow_cold_read_does_not_overwrite_refresh(monkeypatch):
+    release_cold_read = asyncio.Event()
+
+    async def fake_load(refresh: bool):
+        if refresh:
+            return [{"name": "NEW"}]
+        await release_cold_read.wait()
+        return [{"name": "OLD"}]
+
+    monkeypatch.setattr(main, "_load_characters", fake_load)
+
+    cold = asyncio.ensure_future(main._get_characters_from_source(False))
+    await asyncio.sleep(0)
+    refresh = asyncio.ensure_future(main._get_characters_from_source(True))
+    await asyncio.sleep(0)
+    release_cold_read.set()
+    await asyncio.gather(cold, refresh)
+
+    snapshot = await main._get_characters_from_source(False)
+    assert snapshot.characters == [{"name": "NEW"}]
+
+
+async def test_cache_from_other_enrichment_version_is_re_enriched(monkeypatch):
+    main._replace_cache_sync(
+        [{"name": "Stale", "homeworld": "http://swapi.test/planets/1", "homeworld_name": "Old Name"}]
+    )
+    main.app.state.enrichment_ok = False
+
+    async def fake_resolve(urls):
+        return {"http://swapi.test/planets/1": "New Name"}
+
+    monkeypatch.setattr(main, "_resolve_urls", fake_resolve)
+
+    [char] = await main._load_characters(False)
+
+    assert char["homeworld_name"] == "New Name"
+    assert main.app.state.enrichment_ok is True